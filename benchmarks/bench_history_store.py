@@ -0,0 +1,63 @@
+"""
+Benchmarks playback history writes with many guilds ending tracks concurrently.
+Run from the repo root: python -m benchmarks.bench_history_store [--guilds 1000] [--tracks 200]
+"""
+import os
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+
+from utils.history_store import PlaybackHistory, PlayRecord, COMPLETED, SKIPPED
+
+
+async def guild(history: PlaybackHistory, guild_id: int, tracks: int, stalls: list[float]) -> None:
+    """Ends tracks back to back, timing how long each record() holds up the event path"""
+    rng = random.Random(guild_id)
+    for _ in range(tracks):
+        now = time.time()
+        play = PlayRecord(guild_id, f'track{rng.randrange(500)}', 'title', 'https://example.com', rng.randrange(50),
+                          now - 180, now, COMPLETED if rng.random() < .8 else SKIPPED)
+
+        start = time.perf_counter()
+        history.record(play)
+        stalls.append(time.perf_counter() - start)
+        await asyncio.sleep(0)
+
+
+async def run(guilds: int, tracks: int) -> None:
+    with tempfile.TemporaryDirectory() as tmp:
+        history = PlaybackHistory(os.path.join(tmp, 'history.db'))
+        history.start()
+        stalls = list()
+
+        start = time.perf_counter()
+        await asyncio.gather(*(guild(history, guild_id, tracks, stalls) for guild_id in range(guilds)))
+        recorded = time.perf_counter() - start
+        await history.flush()
+        written = time.perf_counter() - start
+
+        total = guilds * tracks
+        stalls.sort()
+        print(f"{total} plays from {guilds} guilds: recorded in {recorded:.2f}s, written in {written:.2f}s "
+              f"({total / written:,.0f} plays/s)")
+        print(f"record() p99 {stalls[round((len(stalls) - 1) * .99)] * 1e6:.1f}us | max {stalls[-1] * 1e6:.1f}us")
+
+        start = time.perf_counter()
+        await history.top(0)
+        await history.recent(0)
+        print(f"top + recent: {(time.perf_counter() - start) * 1000:.2f}ms")
+        await history.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--guilds', type=int, default=1000)
+    parser.add_argument('--tracks', type=int, default=200)
+    args = parser.parse_args()
+    asyncio.run(run(args.guilds, args.tracks))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""
+Benchmarks scanning and searching the local library on a synthetic tree
+of short WAV files. Tags and durations are only read when mutagen is
+installed, so tag extraction is also timed on its own.
+Run from the repo root: python -m benchmarks.bench_local_library [--files 100000]
+"""
+import io
+import os
+import time
+import wave
+import random
+import argparse
+import tempfile
+
+from utils import local_library
+from utils.local_library import LocalLibrary, read_tags
+
+WORDS = ['alpha', 'bravo', 'charlie', 'delta', 'echo', 'foxtrot', 'golf', 'hotel', 'india',
+         'juliet', 'kilo', 'lima', 'mike', 'november', 'oscar', 'papa', 'quebec', 'romeo']
+
+
+def silent_wav(seconds: float = 0.01) -> bytes:
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'wb') as audio:
+        audio.setnchannels(1)
+        audio.setsampwidth(1)
+        audio.setframerate(8000)
+        audio.writeframes(b'\x80' * int(8000 * seconds))
+    return buffer.getvalue()
+
+
+def build_tree(root: str, files: int) -> list[str]:
+    """Creates short WAV files named from random words, 100 per directory"""
+    rng = random.Random(0)
+    audio = silent_wav()
+    names = list()
+    for i in range(files):
+        directory = os.path.join(root, f'{i // 10000:02}', f'{(i // 100) % 100:02}')
+        if i % 100 == 0:
+            os.makedirs(directory, exist_ok=True)
+
+        name = f'{" ".join(rng.sample(WORDS, 3))} {i}'
+        with open(os.path.join(directory, f'{name}.wav'), 'wb') as file:
+            file.write(audio)
+        names.append(name)
+    return names
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--files', type=int, default=100000)
+    parser.add_argument('--queries', type=int, default=1000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        music_dir = os.path.join(tmp, 'music')
+        names, elapsed = timed(build_tree, music_dir, args.files)
+        print(f"Built {args.files} files in {elapsed:.2f}s")
+
+        sample = [os.path.join(music_dir, '00', '00', name) for name in os.listdir(os.path.join(music_dir, '00', '00'))]
+        _, elapsed = timed(lambda: [read_tags(path) for path in sample])
+        if local_library.mutagen is None:
+            print("mutagen is not installed, scans below use file names instead of reading tags")
+        else:
+            print(f"Tag extraction: {elapsed / len(sample) * 1000:.3f}ms per file, included in the scans below")
+
+        library = LocalLibrary(os.path.join(tmp, 'library.db'), [music_dir])
+        (indexed, _, _), elapsed = timed(library.scan)
+        print(f"Full scan: {indexed} indexed in {elapsed:.2f}s")
+
+        _, elapsed = timed(library.scan)
+        print(f"Rescan, nothing changed: {elapsed:.2f}s")
+
+        changed = os.path.join(music_dir, '00', '00')
+        for name in os.listdir(changed)[:10]:
+            os.utime(os.path.join(changed, name), (1, 1))
+        (indexed, _, _), elapsed = timed(library.scan)
+        print(f"Rescan, {indexed} changed: {elapsed:.2f}s")
+
+        rng = random.Random(1)
+        queries = [' '.join(rng.sample(name.split(), 2)) for name in rng.sample(names, min(args.queries, len(names)))]
+        latencies = list()
+        for query in queries:
+            _, elapsed = timed(library.search, query)
+            latencies.append(elapsed * 1000)
+
+        latencies.sort()
+        last = len(latencies) - 1
+        print(f"Search over {len(latencies)} queries: p50 {latencies[last // 2]:.2f}ms | "
+              f"p95 {latencies[round(last * .95)]:.2f}ms | max {latencies[last]:.2f}ms")
+        library.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -15,6 +15,19 @@ class Info(commands.Cog):
         info_lst = '\n'.join([py_ver, sys_info])  # Joining the list with newline as the delimiter
         embed.add_field(name="System info", value=info_lst)
         return await ctx.send(embed=embed)
+
+    @commands.command(description="Displays event loop lag")
+    async def lag(self, ctx):
+        watchdog = getattr(self.bot, 'loop_watchdog', None)
+        if watchdog is None or not watchdog.running:
+            embed = discord.Embed(title="", description="Loop watchdog is not running", color=discord.Color.red())
+            return await ctx.send(embed=embed, delete_after=60)
+
+        lag = watchdog.percentiles(50, 95, 99, 100)
+        embed = discord.Embed(title="Event loop lag", color=discord.Color.blurple())
+        embed.add_field(name="Percentiles", value=f"p50: `{lag[50]:.1f}ms`\np95: `{lag[95]:.1f}ms`\np99: `{lag[99]:.1f}ms`\nmax: `{lag[100]:.1f}ms`")
+        embed.add_field(name="Stalls", value=f"{watchdog.stall_count} over {watchdog.threshold}s")
+        return await ctx.send(embed=embed, delete_after=60)
     
 async def setup(bot):
     info = Info(bot)
@@ -1,5 +1,6 @@
 import os
 import copy
+import time
 import random
 import discord
 import asyncio
@@ -11,7 +12,11 @@ from discord.ext import commands
 
 from global_vars.timeout import *
 from global_vars.regex import SPOT_REG_V2
+from global_vars.display import EMBED_DESCRIPTION_LIMIT, HISTORY_PAGE_SIZE
 from utils.time_parse_util import time_format
+from utils.local_library import LocalLibrary
+from utils.stage_timer import StageTimer
+from utils.history_store import PlaybackHistory, PlayRecord, COMPLETED, SKIPPED, FAILED
 
 logging.getLogger().setLevel(logging.INFO)
 
@@ -30,9 +35,14 @@ class MusicBot(commands.Cog):
     queue_message = None
     vc : wavelink.Player = None
     now_playing_lst = list()
+    library : LocalLibrary = None
     
     def __init__(self, bot):
         self.bot = bot
+        self.background_tasks = set()
+        self.track_starts = dict()  # Guild id -> time the current track started
+        self.scan_task = None
+        self.history = PlaybackHistory(os.environ.get('HISTORY_DB', 'history.db'))
 
 
     def _is_connected(self, ctx):
@@ -54,6 +64,53 @@ class MusicBot(commands.Cog):
         """     
         node: wavelink.Node = wavelink.Node(uri=os.environ['LAVALINK_SERVER'], password=os.environ['LAVALINK_SERVER_PASSWORD'])
         await wavelink.Pool.connect(client=self.bot, nodes=[node], cache_capacity=100)
+        self.history.start()
+
+        # Directories must be mounted at the same path for Lavalink
+        music_dirs = os.environ.get('LOCAL_MUSIC_DIRS')
+        if music_dirs:
+            self.library = LocalLibrary(os.environ.get('LOCAL_LIBRARY_DB', 'library.db'), music_dirs.split(os.pathsep))
+            self.scan_task = self.spawn(self.scan_library())
+
+
+    async def scan_library(self) -> tuple[int, int, int]:
+        """
+        Rescans the local library off the event loop
+        """
+        indexed, removed, total = await asyncio.to_thread(self.library.scan)
+        logging.info(f"Local library scanned: {indexed} indexed | {removed} removed | {total} total")
+        return indexed, removed, total
+
+
+    async def search_tracks(self, user_input: str) -> wavelink.Search:
+        """
+        Resolves user input against the local library first,
+        falling back to Lavalink's remote sources
+        """
+        if self.library and self.library.contains(user_input):
+            # Local tracks come back from the history as file paths
+            return await wavelink.Playable.search(user_input, source=None)
+
+        if self.library:
+            local_track = await asyncio.to_thread(self.library.search, user_input)
+            if local_track:
+                try:
+                    tracks: wavelink.Search = await wavelink.Playable.search(local_track.path, source=None)
+                except wavelink.LavalinkLoadException as e:
+                    logging.warning(f"Unable to load local file {local_track.path}, searching remote sources: {e}")
+                else:
+                    if tracks:
+                        return tracks
+
+        return await wavelink.Playable.search(user_input)
+
+
+    async def cog_unload(self) -> None:
+        await self.history.close()
+        if self.library:
+            if self.scan_task is not None and not self.scan_task.done():
+                await asyncio.wait([self.scan_task])
+            self.library.close()
 
 
     async def get_spotify_redirect(self, url: str) -> str:
@@ -62,7 +119,84 @@ class MusicBot(commands.Cog):
         follows the redirect, and returns a Spotify url of the form
         https://open.spotify.com/MEDIA_TYPE/r
         """
-        return urllib.request.urlopen(url).geturl().split('&')[0]
+        response = await asyncio.to_thread(urllib.request.urlopen, url)
+        return response.geturl().split('&')[0]
+
+
+    async def resolve_tracks(self, user_input: str, timer: StageTimer) -> wavelink.Search:
+        """
+        Follows Spotify redirects and searches for the user input,
+        recording how long each stage takes
+        """
+        if SPOT_REG_V2.match(user_input):
+            with timer.stage('redirect'):
+                user_input = await self.get_spotify_redirect(user_input)
+
+        with timer.stage('search'):
+            return await self.search_tracks(user_input)
+
+
+    def tag_requester(self, tracks: wavelink.Search, requester_id: int) -> wavelink.Search:
+        """
+        Returns copies of the tracks with the requester set in their extras,
+        search results are cached by wavelink and shared between requests
+        """
+        if isinstance(tracks, wavelink.Playlist):
+            tracks = copy.copy(tracks)
+            tracks.tracks = [copy.copy(track) for track in tracks.tracks]
+            track_lst = tracks.tracks
+        elif isinstance(tracks, list):
+            tracks = [copy.copy(track) for track in tracks]
+            track_lst = tracks
+        else:
+            return tracks
+
+        # Extras are sent to Lavalink as userData, so they come back on the track events
+        for track in track_lst:
+            track.extras = {'requester': requester_id}
+
+        return tracks
+
+
+    def fit_description(self, lines: list[str]) -> str:
+        """
+        Joins as many lines as fit in an embed description
+        """
+        description = ''
+        for line in lines:
+            if EMBED_DESCRIPTION_LIMIT < len(description) + len(line) + 1:
+                break
+            description += f"{line}\n"
+
+        return description
+
+
+    def spawn(self, coro) -> asyncio.Task:
+        """
+        Runs a coroutine in the background, used to keep
+        cosmetic requests off of the playback path
+        """
+        task = asyncio.create_task(coro)
+        self.background_tasks.add(task)
+        task.add_done_callback(self._background_task_done)
+        return task
+
+
+    def _background_task_done(self, task: asyncio.Task) -> None:
+        self.background_tasks.discard(task)
+        if not task.cancelled() and task.exception():
+            logging.error(task.exception(), exc_info=task.exception())
+
+
+    async def send_embed(self, ctx, embed: discord.Embed, defer: bool = False, **kwargs):
+        """
+        Sends an embed, or schedules it in the background if deferred
+        """
+        if defer:
+            self.spawn(ctx.send(embed=embed, **kwargs))
+            return None
+
+        return await ctx.send(embed=embed, **kwargs)
 
 
     async def clear_messages(self) -> None:
@@ -130,6 +264,7 @@ class MusicBot(commands.Cog):
         
         original = payload.original
         track = payload.track
+        self.track_starts[player.guild.id] = time.time()
 
         embed = discord.Embed(title="Now Playing", description=f"[{track.title}]({track.uri}) - {time_format(track.length)} ", color=discord.Color.green())
 
@@ -142,6 +277,28 @@ class MusicBot(commands.Cog):
         self.now_playing_lst.append(await self.music_channel.send(embed=embed, delete_after=(track.length / 1000)))
 
 
+    @commands.Cog.listener()
+    async def on_wavelink_track_end(self, payload: wavelink.TrackEndEventPayload) -> None:
+        player = payload.player
+        track = payload.track
+
+        if not player or not track:
+            return
+
+        now = time.time()
+        started_at = self.track_starts.pop(player.guild.id, now)
+
+        if payload.reason == 'finished':
+            outcome = COMPLETED
+        elif payload.reason == 'loadFailed':
+            outcome = FAILED
+        else:
+            outcome = SKIPPED
+
+        requester_id = getattr(track.extras, 'requester', None)
+        self.history.record(PlayRecord(player.guild.id, track.identifier, track.title, track.uri, requester_id, started_at, now, outcome))
+
+
     @commands.Cog.listener()
     async def on_voice_state_update(self, member, before: discord.VoiceState, after):
         if self.is_bot_last_vc_member(before.channel):
@@ -157,14 +314,15 @@ class MusicBot(commands.Cog):
             await player.disconnect()
  
 
-    @commands.command(name='join', aliases=['connect', 'j'], description="Joins the bot into the voice channel")
-    async def join(self, ctx):
-        await ctx.typing()
-
+    async def connect_voice(self, ctx, defer_messages: bool = False):
+        """
+        Joins or moves to the author's voice channel. Deferred messages
+        are sent in the background so playback can start sooner
+        """
         voice = ctx.message.author.voice
         if not voice or ctx.author.voice.channel is None or ctx.author.voice is None:
             embed = discord.Embed(title="", description="You're not connected to a voice channel", color=discord.Color.red())
-            await ctx.send(embed=embed)
+            await self.send_embed(ctx, embed, defer=defer_messages)
             return False
 
         channel = voice.channel
@@ -173,17 +331,26 @@ class MusicBot(commands.Cog):
 
         if ctx.voice_client is None:
             self.vc = await channel.connect(cls=wavelink.Player, self_deaf=True)
-            await self.vc.set_volume(100)  # Set volume to 100%
             self.vc.inactive_timeout = AFK_TIMEOUT
+            if defer_messages:
+                self.spawn(self.vc.set_volume(100))  # Set volume to 100%
+            else:
+                await self.vc.set_volume(100)
             embed = discord.Embed(title="", description=f"Joined {channel.name}", color=discord.Color.blurple())
-            return await ctx.send(embed=embed, delete_after=120)
+            return await self.send_embed(ctx, embed, defer=defer_messages, delete_after=120)
         elif ctx.guild.voice_client.channel == voice_channel:
             embed = discord.Embed(title="", description=f"I am already in {channel.name}", color=discord.Color.blurple())
-            return await ctx.send(embed=embed, delete_after=120)
+            return await self.send_embed(ctx, embed, defer=defer_messages, delete_after=120)
             
         await ctx.voice_client.move_to(voice_channel)
         embed = discord.Embed(title="", description=f"Moved to {channel.name}", color=discord.Color.blurple())
-        return await ctx.send(embed=embed, delete_after=120)
+        return await self.send_embed(ctx, embed, defer=defer_messages, delete_after=120)
+
+
+    @commands.command(name='join', aliases=['connect', 'j'], description="Joins the bot into the voice channel")
+    async def join(self, ctx):
+        await ctx.typing()
+        return await self.connect_voice(ctx)
 
 
     @commands.command(name='leave', aliases=["dc", "disconnect", "bye"], description="Leaves the channel")
@@ -211,49 +378,67 @@ class MusicBot(commands.Cog):
 
     @commands.command(name='play', aliases=['sing','p'], description="Plays a given input if it's valid")
     async def play(self, ctx, *, user_input=None, play_now=False):
+        resolve_task = None
+        timer = StageTimer()
         try:
             if not user_input:
                 embed = discord.Embed(title="", description="Please enter something to play", color=discord.Color.red())
                 return await ctx.send(embed=embed)
 
+            # Resolve the input while the voice connection is being set up
+            resolve_task = asyncio.create_task(self.resolve_tracks(user_input, timer))
+
             if not self._is_connected(ctx):
-                if await ctx.invoke(self.bot.get_command('join')) == False:
-                    return
+                with timer.stage('join'):
+                    if await self.connect_voice(ctx, defer_messages=True) == False:
+                        return
 
             if ctx.guild.voice_client.channel != ctx.message.author.voice.channel:
                 embed = discord.Embed(title="", description="You're not connected to the same voice channel as me", color=discord.Color.red())
                 return await ctx.send(embed=embed)
-            
-            if SPOT_REG_V2.match(user_input):
-                user_input = await self.get_spotify_redirect(user_input)
 
             self.vc.autoplay = wavelink.AutoPlayMode.enabled
 
-            tracks: wavelink.Search = await wavelink.Playable.search(user_input)  # tracks: wavelink.Search
+            tracks: wavelink.Search = await resolve_task
         
             if not tracks or (isinstance(tracks, list) and len(tracks) < 1):
                 RuntimeError("Search did not return any results")
 
-            if isinstance(tracks, wavelink.Playlist) or isinstance(tracks, list):
-                tracks_added: int = await self.vc.queue.put_wait(tracks)
-                embed = discord.Embed(title="", description=f"Added {tracks_added} tracks to the queue [{ctx.author.mention}]", color=discord.Color.green())
-                await ctx.send(embed=embed, delete_after=120)
-            else:
-                track : wavelink.Playable = tracks[0]
-                if self.vc.playing:
-                    embed = discord.Embed(title="", description=f"Queued [{track.title}]({(track.uri)}) [{ctx.author.mention}]", color=discord.Color.green())              
-                    await ctx.send(embed=embed, delete_after=120)  # Delete after 2 minutes
+            with timer.stage('queue'):
+                tracks = self.tag_requester(tracks, ctx.author.id)
+
+                if isinstance(tracks, wavelink.Playlist) or isinstance(tracks, list):
+                    tracks_added: int = await self.vc.queue.put_wait(tracks)
+                    embed = discord.Embed(title="", description=f"Added {tracks_added} tracks to the queue [{ctx.author.mention}]", color=discord.Color.green())
+                    await self.send_embed(ctx, embed, defer=True, delete_after=120)
+                else:
+                    track : wavelink.Playable = tracks[0]
+                    if self.vc.playing:
+                        embed = discord.Embed(title="", description=f"Queued [{track.title}]({(track.uri)}) [{ctx.author.mention}]", color=discord.Color.green())              
+                        await self.send_embed(ctx, embed, defer=True, delete_after=120)  # Delete after 2 minutes
 
-                await self.vc.queue.put_wait(track) if not play_now else self.vc.queue.put_at(0, track)
+                    await self.vc.queue.put_wait(track) if not play_now else self.vc.queue.put_at(0, track)
 
             if not self.vc.playing:
-                self.current_track = self.vc.queue.get()
-                await self.vc.play(self.current_track)
+                with timer.stage('start'):
+                    self.current_track = self.vc.queue.get()
+                    await self.vc.play(self.current_track)
 
         except Exception as e:
             logging.error(e, exc_info=True)
             embed = discord.Embed(title=f"Error", description=f"""Something went wrong with the track you sent, please try again.\nStack trace: {e}""", color=discord.Color.red())
             return await ctx.send(embed=embed)
+
+        finally:
+            if resolve_task is not None:
+                # Logged for failed plays too, to show which stage they got stuck on
+                timer.mark('total')
+                logging.info(f"Play timings: {timer}")
+
+                if not resolve_task.done():
+                    resolve_task.cancel()
+                elif not resolve_task.cancelled():
+                    resolve_task.exception()  # Results aren't needed if the play was rejected
         
 
     @commands.command(name='play_now', aliases=['pn'], description="Inserts a track at the front of the queue")
@@ -264,6 +449,44 @@ class MusicBot(commands.Cog):
             return await ctx.invoke(self.bot.get_command('play'), user_input=user_input, play_now=True)
 
 
+    @commands.command(name='recent', aliases=['history'], description="Shows the most recently played tracks")
+    async def recent(self, ctx, count: int = 10):
+        plays = await self.history.recent(ctx.guild.id, min(max(count, 1), HISTORY_PAGE_SIZE))
+        if not plays:
+            embed = discord.Embed(title="", description="Nothing has been played yet", color=discord.Color.blue())
+            return await ctx.send(embed=embed)
+
+        song_lst = list()
+        for i, play in enumerate(plays):
+            requester = f" [<@{play.requester_id}>]" if play.requester_id else ""
+            song_lst.append(f"{i + 1}. [{play.title}]({play.uri}) - {play.outcome}{requester}")
+
+        embed = discord.Embed(title="Recently Played", description=self.fit_description(song_lst), color=discord.Color.blurple())
+        return await ctx.send(embed=embed, delete_after=QUEUE_TIMEOUT)
+
+
+    @commands.command(name='top', description="Shows the most played tracks")
+    async def top(self, ctx, count: int = 10):
+        tracks = await self.history.top(ctx.guild.id, min(max(count, 1), HISTORY_PAGE_SIZE))
+        if not tracks:
+            embed = discord.Embed(title="", description="Nothing has been played yet", color=discord.Color.blue())
+            return await ctx.send(embed=embed)
+
+        song_lst = [f"{i + 1}. [{title}]({uri}) - {plays} plays" for i, (title, uri, plays) in enumerate(tracks)]
+        embed = discord.Embed(title="Most Played", description=self.fit_description(song_lst), color=discord.Color.blurple())
+        return await ctx.send(embed=embed, delete_after=QUEUE_TIMEOUT)
+
+
+    @commands.command(name='replay', aliases=['rp'], description="Queues a track from the recently played list")
+    async def replay(self, ctx, track_num: int = 1):
+        plays = await self.history.recent(ctx.guild.id, track_num) if 0 < track_num <= HISTORY_PAGE_SIZE else list()
+        if len(plays) < track_num or not plays or not plays[track_num - 1].uri:
+            embed = discord.Embed(title="", description="Please send a valid track to replay", color=discord.Color.red())
+            return await ctx.send(embed=embed)
+
+        return await ctx.invoke(self.bot.get_command('play'), user_input=plays[track_num - 1].uri)
+
+
     @commands.command(name='queue', aliases=['q', 'playlist', 'que'], description="Shows the queue")
     async def queue(self, ctx):
         await ctx.typing()
@@ -507,6 +730,25 @@ class MusicBot(commands.Cog):
             await self.clear_messages()
 
 
+    @commands.is_owner()
+    @commands.command(description="Rescans the local music library")
+    async def rescan(self, ctx):
+        if not self.library:
+            embed = discord.Embed(title="", description="No local library is configured", color=discord.Color.red())
+            return await ctx.send(embed=embed, delete_after=60)
+
+        if (self.scan_task is not None and not self.scan_task.done()) or self.library.scanning:
+            embed = discord.Embed(title="", description="A library scan is already in progress", color=discord.Color.blue())
+            return await ctx.send(embed=embed, delete_after=60)
+
+        await ctx.typing()
+        self.scan_task = self.spawn(self.scan_library())
+        indexed, removed, total = await asyncio.shield(self.scan_task)
+
+        embed = discord.Embed(title="", description=f"Library rescanned: {indexed} indexed, {removed} removed, {total} total", color=discord.Color.green())
+        return await ctx.send(embed=embed, delete_after=60)
+
+
     @commands.command(description="Sets the output volume", aliase=['vol'])
     async def volume(self, ctx, new_volume):
         if not await self.validate_command(ctx) or not self.vc.playing or not new_volume.isdigit():
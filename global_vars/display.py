@@ -0,0 +1,7 @@
+"""
+Limits on how much the bot puts in a message
+"""
+from typing import Final
+
+EMBED_DESCRIPTION_LIMIT: Final[int] = 4096  # Max characters Discord allows in an embed description
+HISTORY_PAGE_SIZE: Final[int] = 10  # Max tracks shown by !recent and !top, and replayable with !replay
@@ -4,4 +4,7 @@ Constants for timeout for leaving the chat, deleting messages, etc
 from typing import Final
 
 AFK_TIMEOUT: Final[int] = 600   # Amount of seconds before the bot disconnects due to nothing being played
-QUEUE_TIMEOUT: Final[int] = 180  # Time before users aren't able to interact with the queue pages
\ No newline at end of file
+QUEUE_TIMEOUT: Final[int] = 180  # Time before users aren't able to interact with the queue pages
+LOOP_LAG_INTERVAL: Final[float] = 0.25  # Seconds between event loop lag samples
+LOOP_STALL_THRESHOLD: Final[float] = 0.5  # Seconds the event loop can be blocked before the stack is logged
+HISTORY_FLUSH_INTERVAL: Final[int] = 5  # Seconds between writes of buffered playback history
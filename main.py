@@ -5,20 +5,46 @@ Before running, start lavalink server.
 
 import os
 import time
+import asyncio
+import logging
 import discord
 from discord.ext import commands
 
+from utils.loop_watchdog import LoopWatchdog
+
+def use_uvloop():
+    """Switches to the uvloop event loop if USE_UVLOOP is set and uvloop is installed"""
+    if os.environ.get('USE_UVLOOP', '').lower() not in ('1', 'true', 'yes'):
+        return
+
+    try:
+        import uvloop
+    except ImportError:
+        logging.warning("USE_UVLOOP is set but uvloop is not installed, using the default event loop")
+        return
+
+    asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    logging.info("Using uvloop event loop")
+
 def run():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(name)s: %(message)s')
     cogs = ["cogs.music", "cogs.misc"]
     bot = commands.Bot(commands.when_mentioned_or('!'), intents=discord.Intents.all(), case_insensitive=True)
+    bot.loop_watchdog = LoopWatchdog()
     time.sleep(int(os.environ['WAIT_TIME']))  # Allow Lavalink server to start up
 
+    async def setup_hook():
+        bot.loop_watchdog.start()
+
+    bot.setup_hook = setup_hook
+
     @bot.event
     async def on_ready():
         await bot.change_presence(activity=discord.Activity(type=discord.ActivityType.watching, name='for !'), status=discord.Status.idle)
         for cog in cogs:
             await bot.load_extension(cog)
 
+    use_uvloop()
     bot.run(os.environ['BOT_KEY'], reconnect=True, root_logger=False)
 
 if __name__ == "__main__":
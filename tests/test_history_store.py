@@ -0,0 +1,47 @@
+import asyncio
+
+import pytest
+
+from utils.history_store import PlaybackHistory, PlayRecord, COMPLETED, SKIPPED
+
+
+def play(guild_id, track_id, title, started_at, outcome=COMPLETED):
+    return PlayRecord(guild_id, track_id, title, f'https://example.com/{track_id}', 42, started_at, started_at + 1, outcome)
+
+
+def test_top_uses_latest_title(tmp_path):
+    async def run():
+        history = PlaybackHistory(str(tmp_path / 'history.db'))
+        history.record(play(1, 'a', 'Old title', 1))
+        history.record(play(1, 'a', 'New title', 2))
+        history.record(play(1, 'b', 'Other', 3, SKIPPED))
+        history.record(play(2, 'b', 'Other guild', 4))
+        top = await history.top(1)
+        recent = await history.recent(1)
+        await history.close()
+        return top, recent
+
+    top, recent = asyncio.run(run())
+
+    assert top == [('New title', 'https://example.com/a', 2), ('Other', 'https://example.com/b', 1)]
+    assert [p.title for p in recent] == ['Other', 'New title', 'Old title']
+
+
+def test_failed_flush_keeps_plays(tmp_path, monkeypatch):
+    async def run():
+        history = PlaybackHistory(str(tmp_path / 'history.db'))
+        history.record(play(1, 'a', 'Title', 1))
+
+        def fail(rows):
+            raise OSError('disk full')
+
+        monkeypatch.setattr(history, '_write', fail)
+        with pytest.raises(OSError):
+            await history.flush()
+
+        monkeypatch.undo()
+        written = await history.flush()
+        await history.close()
+        return written
+
+    assert asyncio.run(run()) == 1
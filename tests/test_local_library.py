@@ -0,0 +1,56 @@
+import os
+
+from utils.local_library import LocalLibrary
+
+
+def write(path, content=b''):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(content)
+    return str(path)
+
+
+def fts_rowids(library):
+    files = {row[0] for row in library._conn.execute('SELECT id FROM files')}
+    fts = {row[0] for row in library._conn.execute('SELECT rowid FROM files_fts')}
+    return files, fts
+
+
+def test_rescan_only_reindexes_changed_files(tmp_path):
+    music = tmp_path / 'music'
+    kept = write(music / 'Daft Punk - One More Time.mp3')
+    changed = write(music / 'albums' / 'Harder Better.flac')
+    deleted = write(music / 'Around The World.ogg')
+    write(music / 'cover.jpg')
+    library = LocalLibrary(str(tmp_path / 'library.db'), [str(music)])
+
+    assert library.scan() == (3, 0, 3)
+    assert library.scan() == (0, 0, 3)
+
+    with open(changed, 'ab') as file:
+        file.write(b'more audio')  # Size changes
+    os.utime(kept, (1, 1))  # Only the mtime changes
+    os.remove(deleted)
+
+    assert library.scan() == (2, 1, 2)
+    assert library.search('around world') is None
+
+    files, fts = fts_rowids(library)
+    assert files == fts and len(files) == 2
+    assert library.search('harder better').path == changed
+    assert library.search('one more time').path == kept
+    library.close()
+
+
+def test_search_needs_whole_words(tmp_path):
+    music = tmp_path / 'music'
+    path = write(music / 'Lovely Day.mp3')
+    library = LocalLibrary(str(tmp_path / 'library.db'), [str(music)])
+    library.scan()
+
+    assert library.search('LOVELY day').path == path
+    assert library.search('love') is None
+    assert library.search('lovely night') is None
+    assert library.search('https://example.com/lovely') is None
+    assert library.search('ytsearch:lovely') is None
+    assert library.search('!!!') is None
+    library.close()
@@ -0,0 +1,30 @@
+import time
+import asyncio
+
+from utils.loop_watchdog import LoopWatchdog
+
+
+async def blocker():
+    time.sleep(1.2)
+
+
+def test_watchdog_reports_blocking_call():
+    async def run():
+        watchdog = LoopWatchdog(interval=0.05, threshold=0.2)
+        watchdog.start()
+        await asyncio.sleep(0.3)
+        await asyncio.create_task(blocker())
+        await asyncio.sleep(0.2)
+        watchdog.stop()
+        return watchdog
+
+    watchdog = asyncio.run(run())
+
+    assert watchdog.stall_count == 1
+    assert len(watchdog.stalls) == 1
+    assert 'blocker' in watchdog.stalls[0]
+    assert 1000 <= watchdog.percentiles(100)[100]
+
+
+def test_percentiles_without_samples():
+    assert LoopWatchdog().percentiles(50, 99) == {50: 0.0, 99: 0.0}
@@ -0,0 +1,230 @@
+"""
+Runs MusicBot.play against fake Discord/Lavalink objects with fixed
+delays, to check the voice join and track search overlap, and that
+requesters and local paths make it through the play path.
+"""
+import sys
+import time
+import types
+import asyncio
+import logging
+import importlib
+from unittest.mock import MagicMock
+
+import pytest
+
+from utils.local_library import LocalLibrary
+
+JOIN_DELAY = 0.3
+SEARCH_DELAY = 0.3
+SEND_DELAY = 0.2
+PLAY_DELAY = 0.05
+
+
+def passthrough(*args, **kwargs):
+    return lambda func: func
+
+
+class FakeCog:
+    listener = staticmethod(passthrough)
+
+
+class FakePlaylist:
+    def __init__(self, tracks):
+        self.tracks = tracks
+
+    def __iter__(self):
+        return iter(self.tracks)
+
+    def __len__(self):
+        return len(self.tracks)
+
+
+class FakeTrack:
+    def __init__(self, title):
+        self.title = title
+        self.uri = f'https://example.com/{title}'
+        self.identifier = title
+        self.extras = dict()
+
+    @property
+    def extras(self):
+        return self._extras
+
+    @extras.setter
+    def extras(self, value):
+        self._extras = types.SimpleNamespace(**value)  # Like wavelink's ExtrasNamespace
+
+
+class FakeQueue(list):
+    async def put_wait(self, item):
+        items = list(item) if isinstance(item, (list, FakePlaylist)) else [item]
+        self.extend(items)
+        return len(items)
+
+    def put_at(self, index, item):
+        self.insert(index, item)
+
+    def get(self):
+        return self.pop(0)
+
+
+class FakePlayer:
+    def __init__(self, channel):
+        self.channel = channel
+        self.guild = channel.guild
+        self.connected = True
+        self.playing = False
+        self.queue = FakeQueue()
+        self.started_at = None
+
+    async def set_volume(self, volume):
+        await asyncio.sleep(SEND_DELAY)
+
+    async def play(self, track):
+        await asyncio.sleep(PLAY_DELAY)
+        self.playing = True
+        self.started_at = time.perf_counter()
+
+
+class FakeChannel:
+    def __init__(self, bot, guild, ctx):
+        self.bot = bot
+        self.guild = guild
+        self.ctx = ctx
+        self.name = 'music'
+
+    async def connect(self, cls, self_deaf):
+        await asyncio.sleep(JOIN_DELAY)
+        player = FakePlayer(self)
+        self.bot.voice_clients.append(player)
+        self.ctx.voice_client = self.guild.voice_client = player
+        return player
+
+
+class FakeContext:
+    def __init__(self, bot):
+        self.bot = bot
+        self.guild = types.SimpleNamespace(id=1, voice_client=None)
+        self.voice_client = None
+        self.author = types.SimpleNamespace(id=42, mention='<@42>')
+        self.author.voice = types.SimpleNamespace(channel=FakeChannel(bot, self.guild, self))
+        self.message = types.SimpleNamespace(author=self.author, channel=object())
+        self.sent = list()
+
+    async def send(self, **kwargs):
+        await asyncio.sleep(SEND_DELAY)
+        self.sent.append(kwargs)
+
+    async def typing(self):
+        await asyncio.sleep(SEND_DELAY)
+
+
+searches = list()
+CACHED_PLAYLIST = FakePlaylist([FakeTrack('first'), FakeTrack('second')])
+
+
+async def fake_search(query, **kwargs):
+    searches.append((query, kwargs))
+    await asyncio.sleep(SEARCH_DELAY)
+    if query == 'playlist':
+        return CACHED_PLAYLIST  # Wavelink hands out the same cached objects for repeated searches
+    return [FakeTrack(query)]
+
+
+@pytest.fixture
+def music(monkeypatch, tmp_path):
+    commands = types.ModuleType('discord.ext.commands')
+    commands.Cog = FakeCog
+    commands.CommandError = Exception
+    commands.command = commands.is_owner = passthrough
+    commands.parameter = lambda **kwargs: None
+    commands.Context = object
+
+    discord = MagicMock()
+    discord.utils.get = lambda clients, guild: next((c for c in clients if c.guild is guild), None)
+    discord.ext.commands = commands
+
+    wavelink = MagicMock()
+    wavelink.Playlist = FakePlaylist
+    wavelink.Playable.search = fake_search
+
+    monkeypatch.setitem(sys.modules, 'discord', discord)
+    monkeypatch.setitem(sys.modules, 'discord.ext', discord.ext)
+    monkeypatch.setitem(sys.modules, 'discord.ext.commands', commands)
+    monkeypatch.setitem(sys.modules, 'wavelink', wavelink)
+    monkeypatch.delitem(sys.modules, 'cogs.music', raising=False)
+    monkeypatch.setenv('HISTORY_DB', str(tmp_path / 'history.db'))
+    monkeypatch.delenv('LOCAL_MUSIC_DIRS', raising=False)
+    searches.clear()
+
+    module = importlib.import_module('cogs.music')
+    yield module
+    sys.modules.pop('cogs.music', None)
+
+
+def test_play_overlaps_join_and_search(music, caplog):
+    async def run():
+        bot = types.SimpleNamespace(voice_clients=list())
+        cog = music.MusicBot(bot)
+        ctx = FakeContext(bot)
+
+        start = time.perf_counter()
+        await cog.play(ctx, user_input='song')
+        first_audio = cog.vc.started_at - start
+
+        await asyncio.gather(*cog.background_tasks)
+        await cog.history.close()
+        return first_audio, ctx
+
+    with caplog.at_level(logging.INFO):
+        first_audio, ctx = asyncio.run(run())
+
+    # Sequentially this would be join + search + messages + play
+    assert max(JOIN_DELAY, SEARCH_DELAY) + PLAY_DELAY <= first_audio
+    assert first_audio < JOIN_DELAY + SEARCH_DELAY
+    assert len(ctx.sent) == 2  # Joined and queued messages still go out in the background
+
+    timings = next(r.getMessage() for r in caplog.records if r.getMessage().startswith('Play timings'))
+    for stage in ('join', 'search', 'queue', 'start', 'total'):
+        assert f'{stage}: ' in timings
+
+
+def test_playlist_requester_reaches_history(music):
+    async def run():
+        bot = types.SimpleNamespace(voice_clients=list())
+        cog = music.MusicBot(bot)
+        ctx = FakeContext(bot)
+
+        await cog.play(ctx, user_input='playlist')
+        payload = types.SimpleNamespace(player=cog.vc, track=cog.current_track, reason='finished')
+        await cog.on_wavelink_track_end(payload)
+
+        await asyncio.gather(*cog.background_tasks)
+        plays = await cog.history.recent(ctx.guild.id)
+        await cog.history.close()
+        return plays, cog
+
+    plays, cog = asyncio.run(run())
+
+    assert [(p.track_id, p.requester_id, p.outcome) for p in plays] == [('first', 42, 'completed')]
+    assert [t.extras.requester for t in cog.vc.queue] == [42]
+    assert not hasattr(CACHED_PLAYLIST.tracks[0].extras, 'requester')  # Cached results aren't changed
+
+
+def test_local_paths_load_without_remote_search(music, tmp_path):
+    music_dir = tmp_path / 'music'
+    music_dir.mkdir()
+    path = str(music_dir / 'song.mp3')
+
+    async def run():
+        cog = music.MusicBot(types.SimpleNamespace(voice_clients=list()))
+        cog.library = LocalLibrary(str(tmp_path / 'library.db'), [str(music_dir)])
+        await cog.search_tracks(path)
+        await cog.search_tracks('/etc/song.mp3')
+        cog.library.close()
+        await cog.history.close()
+
+    asyncio.run(run())
+
+    assert searches == [(path, {'source': None}), ('/etc/song.mp3', {})]
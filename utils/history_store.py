@@ -0,0 +1,162 @@
+"""
+Per-guild playback history. Plays are buffered in memory and written
+to SQLite in batches so track events never wait on the disk.
+"""
+import asyncio
+import sqlite3
+import logging
+import threading
+from typing import NamedTuple
+
+from global_vars.timeout import HISTORY_FLUSH_INTERVAL
+
+COMPLETED = 'completed'
+SKIPPED = 'skipped'
+FAILED = 'failed'
+
+
+class PlayRecord(NamedTuple):
+    guild_id: int
+    track_id: str
+    title: str
+    uri: str
+    requester_id: int | None
+    started_at: float  # Unix timestamps
+    ended_at: float
+    outcome: str
+
+
+class PlaybackHistory:
+    """Buffered store of the tracks played in each guild"""
+    def __init__(self, db_path: str, batch_size: int = 500, flush_interval: float = HISTORY_FLUSH_INTERVAL):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._buffer = list()
+        self._flush_task = None
+        self._batch_task = None
+        self._writes = set()  # Writes still running in a thread
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS plays (
+                id INTEGER PRIMARY KEY,
+                guild_id INTEGER NOT NULL,
+                track_id TEXT NOT NULL,
+                title TEXT NOT NULL,
+                uri TEXT,
+                requester_id INTEGER,
+                started_at REAL NOT NULL,
+                ended_at REAL NOT NULL,
+                outcome TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS plays_guild_started ON plays (guild_id, started_at);
+            CREATE INDEX IF NOT EXISTS plays_guild_track ON plays (guild_id, track_id);
+        """)
+
+
+    def start(self) -> None:
+        """Starts flushing the buffer periodically on the running event loop"""
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_loop())
+
+
+    async def close(self) -> None:
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            await asyncio.gather(self._flush_task, return_exceptions=True)
+            self._flush_task = None
+
+        # Let writes a cancelled flush left running finish before closing the connection
+        await asyncio.gather(*[task for task in (self._batch_task,) if task], *self._writes, return_exceptions=True)
+        await self.flush()
+        with self._lock:
+            self._conn.close()
+
+
+    def record(self, play: PlayRecord) -> None:
+        """Buffers a play, the buffer is written once it's full or on the next interval"""
+        self._buffer.append(play)
+        if self.batch_size <= len(self._buffer) and (self._batch_task is None or self._batch_task.done()):
+            self._batch_task = asyncio.create_task(self.flush())
+            self._batch_task.add_done_callback(self._batch_done)
+
+
+    def _batch_done(self, task: asyncio.Task) -> None:
+        if not task.cancelled() and task.exception():
+            logging.error(task.exception(), exc_info=task.exception())
+
+
+    async def _flush_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logging.error(e, exc_info=True)
+
+
+    async def flush(self) -> int:
+        """Writes the buffered plays to the database.
+
+        Returns:
+            The number of plays written.
+        """
+        if not self._buffer:
+            return 0
+
+        rows, self._buffer = self._buffer, list()
+        write = asyncio.create_task(self._write_batch(rows))
+        self._writes.add(write)
+        write.add_done_callback(self._writes.discard)
+
+        # Shielded so cancelling the caller can't lose a batch mid write
+        await asyncio.shield(write)
+        return len(rows)
+
+
+    async def _write_batch(self, rows: list[PlayRecord]) -> None:
+        try:
+            await asyncio.to_thread(self._write, rows)
+        except Exception:
+            self._buffer[:0] = rows  # Retried on the next flush
+            raise
+
+
+    def _write(self, rows: list[PlayRecord]) -> None:
+        with self._lock, self._conn:
+            self._conn.executemany("""
+                INSERT INTO plays (guild_id, track_id, title, uri, requester_id, started_at, ended_at, outcome)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            """, rows)
+
+
+    def _query(self, sql: str, params: tuple) -> list[tuple]:
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+
+    async def recent(self, guild_id: int, limit: int = 10) -> list[PlayRecord]:
+        """Returns the guild's most recent plays, newest first"""
+        await self.flush()
+        rows = await asyncio.to_thread(self._query, """
+            SELECT guild_id, track_id, title, uri, requester_id, started_at, ended_at, outcome
+            FROM plays WHERE guild_id = ? ORDER BY started_at DESC LIMIT ?
+        """, (guild_id, limit))
+        return [PlayRecord(*row) for row in rows]
+
+
+    async def top(self, guild_id: int, limit: int = 10) -> list[tuple[str, str, int]]:
+        """Returns the title, uri and play count of the guild's most played tracks,
+        using the title and uri from each track's latest play"""
+        await self.flush()
+        return await asyncio.to_thread(self._query, """
+            SELECT p.title, p.uri, t.plays
+            FROM (
+                SELECT track_id, COUNT(*) AS plays, MAX(id) AS last_id
+                FROM plays WHERE guild_id = ?
+                GROUP BY track_id ORDER BY plays DESC LIMIT ?
+            ) t JOIN plays p ON p.id = t.last_id
+            ORDER BY t.plays DESC
+        """, (guild_id, limit))
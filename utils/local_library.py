@@ -0,0 +1,203 @@
+"""
+Indexed library of audio files stored on the same host as Lavalink.
+Tags are kept in an on-disk SQLite full text index so lookups don't
+have to go out to a remote provider.
+"""
+import os
+import re
+import sqlite3
+import logging
+import threading
+from typing import NamedTuple
+
+try:
+    import mutagen
+except ImportError:  # Tags fall back to the file name
+    mutagen = None
+
+AUDIO_EXTENSIONS = frozenset({'.mp3', '.flac', '.wav', '.ogg', '.opus', '.m4a', '.aac', '.webm', '.mp4'})
+
+_TOKEN_REG = re.compile(r'\w+')
+_SCHEME_REG = re.compile(r'^[a-zA-Z][\w+.-]*:\S')  # URLs and search prefixes like ytsearch:
+
+
+class LocalTrack(NamedTuple):
+    path: str
+    title: str
+    artist: str
+    album: str
+    duration: float  # Seconds
+
+
+def read_tags(path: str) -> tuple[str, str, str, float]:
+    """Returns the title, artist, album and duration of an audio file.
+    Missing tags fall back to the file name.
+
+    Args:
+        path - Path to the audio file.
+    """
+    title = os.path.splitext(os.path.basename(path))[0]
+    artist = album = ''
+    duration = 0.0
+
+    if mutagen is None:
+        return title, artist, album, duration
+
+    try:
+        audio = mutagen.File(path, easy=True)
+    except Exception:
+        logging.warning(f"Unable to read tags from {path}")
+        return title, artist, album, duration
+
+    if audio is None:
+        return title, artist, album, duration
+
+    tags = audio.tags or {}
+    title = (tags.get('title') or [title])[0]
+    artist = (tags.get('artist') or [''])[0]
+    album = (tags.get('album') or [''])[0]
+    if audio.info is not None:
+        duration = float(getattr(audio.info, 'length', 0.0) or 0.0)
+
+    return title, artist, album, duration
+
+
+class LocalLibrary:
+    """Full text index of the audio files under a set of directories.
+
+    All methods are blocking, so call them through asyncio.to_thread
+    from the bot.
+    """
+    def __init__(self, db_path: str, directories: list[str]):
+        self.directories = [os.path.abspath(d) for d in directories]
+        self._lock = threading.Lock()
+        self._scan_lock = threading.Lock()  # Scans read the index before writing, so only one runs at a time
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS files (
+                id INTEGER PRIMARY KEY,
+                path TEXT UNIQUE NOT NULL,
+                mtime REAL NOT NULL,
+                size INTEGER NOT NULL,
+                title TEXT NOT NULL,
+                artist TEXT NOT NULL,
+                album TEXT NOT NULL,
+                duration REAL NOT NULL
+            );
+            CREATE VIRTUAL TABLE IF NOT EXISTS files_fts USING fts5(title, artist, album, name);
+        """)
+
+
+    def _walk(self):
+        """Yields (path, mtime, size) for every audio file in the library directories"""
+        for directory in self.directories:
+            for root, _, files in os.walk(directory):
+                for name in files:
+                    if os.path.splitext(name)[1].lower() not in AUDIO_EXTENSIONS:
+                        continue
+
+                    path = os.path.join(root, name)
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        continue
+                    yield path, stat.st_mtime, stat.st_size
+
+
+    def contains(self, path: str) -> bool:
+        """Checks if a path is an audio file inside the library directories, without touching the disk"""
+        if not os.path.isabs(path) or os.path.splitext(path)[1].lower() not in AUDIO_EXTENSIONS:
+            return False
+
+        path = os.path.normpath(path)
+        return any(os.path.commonpath([directory, path]) == directory for directory in self.directories)
+
+
+    @property
+    def scanning(self) -> bool:
+        return self._scan_lock.locked()
+
+
+    def scan(self) -> tuple[int, int, int]:
+        """Indexes new and changed files and drops files that no longer exist.
+        Files are only re-read when their mtime or size has changed.
+
+        Returns:
+            The number of files (re)indexed, the number removed and the total in the library.
+        """
+        with self._scan_lock:
+            return self._scan()
+
+
+    def _scan(self) -> tuple[int, int, int]:
+        with self._lock:
+            known = {path: (file_id, mtime, size) for file_id, path, mtime, size
+                     in self._conn.execute('SELECT id, path, mtime, size FROM files')}
+
+        changed = list()
+        seen = set()
+        for path, mtime, size in self._walk():
+            seen.add(path)
+            entry = known.get(path)
+            if entry is None or entry[1] != mtime or entry[2] != size:
+                changed.append((path, mtime, size, *read_tags(path)))
+
+        removed = [entry[0] for path, entry in known.items() if path not in seen]
+
+        with self._lock, self._conn:
+            for path, mtime, size, title, artist, album, duration in changed:
+                entry = known.get(path)
+                if entry is not None:
+                    self._conn.execute('DELETE FROM files_fts WHERE rowid = ?', (entry[0],))
+
+                file_id = self._conn.execute("""
+                    INSERT INTO files (path, mtime, size, title, artist, album, duration)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT(path) DO UPDATE SET mtime=excluded.mtime, size=excluded.size, title=excluded.title,
+                        artist=excluded.artist, album=excluded.album, duration=excluded.duration
+                    RETURNING id
+                """, (path, mtime, size, title, artist, album, duration)).fetchone()[0]
+
+                name = os.path.splitext(os.path.basename(path))[0]
+                self._conn.execute('INSERT INTO files_fts (rowid, title, artist, album, name) VALUES (?, ?, ?, ?, ?)',
+                                   (file_id, title, artist, album, name))
+
+            self._conn.executemany('DELETE FROM files_fts WHERE rowid = ?', ((file_id,) for file_id in removed))
+            self._conn.executemany('DELETE FROM files WHERE id = ?', ((file_id,) for file_id in removed))
+            total = self._conn.execute('SELECT COUNT(*) FROM files').fetchone()[0]
+
+        return len(changed), len(removed), total
+
+
+    def search(self, query: str) -> LocalTrack | None:
+        """Returns the best match for a query, or None if nothing in the library matches.
+        Every word in the query has to match a whole word in the title, artist,
+        album or file name, so partial words fall through to remote search.
+
+        Args:
+            query - The user's search input.
+        """
+        if _SCHEME_REG.match(query):
+            return None
+
+        tokens = _TOKEN_REG.findall(query.lower())
+        if not tokens:
+            return None
+
+        match = ' '.join(f'"{token}"' for token in tokens)
+        with self._lock:
+            row = self._conn.execute("""
+                SELECT f.path, f.title, f.artist, f.album, f.duration
+                FROM files_fts JOIN files f ON f.id = files_fts.rowid
+                WHERE files_fts MATCH ?
+                ORDER BY bm25(files_fts, 10.0, 5.0, 2.0, 1.0)
+                LIMIT 1
+            """, (match,)).fetchone()
+
+        return LocalTrack(*row) if row else None
+
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
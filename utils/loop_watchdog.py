@@ -0,0 +1,108 @@
+"""
+Watchdog that measures event loop lag and logs what is blocking
+the loop when it stalls.
+"""
+import sys
+import time
+import asyncio
+import logging
+import threading
+import traceback
+from collections import deque
+
+from global_vars.timeout import LOOP_LAG_INTERVAL, LOOP_STALL_THRESHOLD
+
+
+class LoopWatchdog:
+    """Samples event loop lag from a coroutine, while a separate thread
+    checks that the samples keep coming. A blocked loop can't report on
+    itself, so the thread grabs the loop thread's stack once a stall
+    runs past the threshold.
+    """
+    def __init__(self, interval: float = LOOP_LAG_INTERVAL, threshold: float = LOOP_STALL_THRESHOLD, max_samples: int = 2400):
+        self.interval = interval
+        self.threshold = threshold
+        self.samples = deque(maxlen=max_samples)  # Lag in seconds
+        self.stalls = deque(maxlen=50)  # Stacks of the most recent stalls
+        self.stall_count = 0
+        self._loop = None
+        self._loop_thread_id = None
+        self._last_beat = 0.0
+        self._task = None
+        self._thread = None
+        self._stop = threading.Event()
+
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+
+    def start(self) -> None:
+        """Starts the watchdog on the running event loop"""
+        if self.running:
+            return
+
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        self._last_beat = time.monotonic()
+        self._stop.clear()
+
+        self._task = self._loop.create_task(self._sample())
+        self._thread = threading.Thread(target=self._watch, name='loop-watchdog', daemon=True)
+        self._thread.start()
+
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+
+    async def _sample(self) -> None:
+        while True:
+            start = self._loop.time()
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, self._loop.time() - start - self.interval)
+            self.samples.append(lag)
+            self._last_beat = time.monotonic()
+
+            if self.threshold <= lag:
+                logging.debug(f"Event loop was blocked for {lag:.3f}s")  # The watcher thread already logged the stack
+
+
+    def _watch(self) -> None:
+        reported_beat = None
+        while not self._stop.wait(self.threshold / 4):
+            beat = self._last_beat
+            stalled_for = time.monotonic() - beat - self.interval
+            if stalled_for < self.threshold or beat == reported_beat:
+                continue
+
+            # Only report each stall once
+            reported_beat = beat
+            frame = sys._current_frames().get(self._loop_thread_id)
+            if frame is None:
+                continue
+
+            stack = ''.join(traceback.format_stack(frame))
+            task = asyncio.current_task(self._loop)
+            self.stalls.append(stack)
+            self.stall_count += 1
+            logging.warning(f"Event loop stalled for over {stalled_for:.3f}s in {task!r}\n{stack}")
+
+
+    def percentiles(self, *points: float) -> dict[float, float]:
+        """Returns the lag in milliseconds at each percentile.
+
+        Args:
+            points - Percentiles between 0 and 100, defaults to 50, 95, 99 and 100.
+        """
+        points = points or (50, 95, 99, 100)
+        ordered = sorted(self.samples)
+        if not ordered:
+            return {point: 0.0 for point in points}
+
+        last = len(ordered) - 1
+        return {point: ordered[round(last * point / 100)] * 1000 for point in points}
@@ -0,0 +1,29 @@
+import time
+from contextlib import contextmanager
+
+
+class StageTimer:
+    """Records how long each stage of a request takes, in milliseconds.
+    Stages may overlap, so they don't have to add up to the total.
+    """
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.stages = dict()
+
+
+    @contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = (time.perf_counter() - start) * 1000
+
+
+    def mark(self, name: str) -> None:
+        """Records the time from the start of the request to now"""
+        self.stages[name] = (time.perf_counter() - self.start) * 1000
+
+
+    def __str__(self) -> str:
+        return ' | '.join(f"{name}: {ms:.1f}ms" for name, ms in self.stages.items())